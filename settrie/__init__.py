@@ -13,30 +13,99 @@ Project home: https://github.com/mmihaltz/pysettrie
 
 See README.md for more information.
 
+Queries that are run many times can be wrapped in a PreparedQuery once
+to skip sorting them on every call:
+
+>>> q = PreparedQuery({3, 1})
+>>> t1.hassuperset(q), t2.hassuperset(q), q in t3
+
+Sets already held as sorted sequences can skip the sort altogether:
+
+>>> t.add(PreparedQuery((1, 3), presorted=True))
+
 Licensed under the GNU LESSER GENERAL PUBLIC LICENSE, Version 3.
 See https://www.gnu.org/licenses/lgpl.html
 """
 
 import sys
+import types
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
 import sortedcontainers
 
 __version__ = "0.1.3"
 
-class BaseNode(object):
-    
-    # comparison operators to support rich comparisons, sorting
-    # etc. using self.data as key
-    def __eq__(self, other): return self.data == other.data
-    
-    def __ne__(self, other): return self.data != other.data
-    
-    def __lt__(self, other): return self.data < other.data
+# number of children above which a node keeps their data in a
+# SortedList instead of a plain list, where insort would cost a linear
+# memmove per insertion
+SORTEDLIST_MIN_CHILDREN = 4096
 
-    def __le__(self, other): return self.data <= other.data
-    
-    def __gt__(self, other): return self.data > other.data
+# default of SetTrieMap.get() telling a missing key from a None value
+_MISSING = object()
+
+# read-only children_map shared by all leaf nodes, replaced by a dict
+# of their own when they get their first child
+_NO_CHILDREN = types.MappingProxyType({})
+
+
+class PreparedQuery(object):
+    """A set prepared once for being passed to the methods of the set-trie
+       containers many times, holding its elements sorted so that they do
+       not have to be sorted again per call.  If presorted is True, the
+       elements of aset are taken to be distinct and sorted already and
+       are not checked.
+    """
 
-    def __ge__(self, other): return self.data >= other.data
+    __slots__ = ('sorted_list',)
+
+    def __init__(self, aset, presorted=False):
+        self.sorted_list = list(aset) if presorted else sorted(aset)
+
+    def __iter__(self):
+        return iter(self.sorted_list)
+
+    def __len__(self):
+        return len(self.sorted_list)
+
+
+def _sorted(aset):
+    """Return the elements of aset as a sorted list, which must not be
+       modified."""
+    if isinstance(aset, PreparedQuery):
+        return aset.sorted_list
+    return sorted(aset)
+
+
+class BaseNode(object):
+    """Fields shared by the nodes of all set-trie containers."""
+
+    __slots__ = ('children_map', 'sorted_children', 'flag_last', 'data',
+                 'max_sub', 'max_depth_below')
+
+    def __init__(self, data=None):
+        # child nodes a.k.a. children, keyed by their data;
+        # _NO_CHILDREN while there are none, as most nodes are leaves
+        self.children_map = _NO_CHILDREN
+        # data of the child nodes in sorted order, for ordered
+        # traversal: a list, or a SortedList for many children, the
+        # empty tuple while there are none, and a tuple once frozen
+        self.sorted_children = ()
+        # if True, this is the last element of a set in the
+        # set-trie use this to store user data (a set
+        # element). Must be a hashable (i.e. hash(data) should
+        # work) and comparable/orderable (i.e. data1 < data2
+        # should work; see
+        # https://wiki.python.org/moin/HowTo/Sorting/) type.
+        self.flag_last = False
+        self.data = data
+        # largest element of the sets stored in the subtree rooted
+        # at this node (of all sets for the root, None while none
+        # is stored), used to prune superset searches
+        self.max_sub = data
+        # largest number of elements on a path from this node down to
+        # the end of a set, used to prune superset searches
+        self.max_depth_below = 0
 
 class SetTrie(object):
     """Set-trie container of sets for efficient supersets/subsets of a set
@@ -63,51 +132,247 @@ class SetTrie(object):
     class Node(BaseNode):
         """Node object used by SetTrie."""
 
-        def __init__(self, data=None):
-            # child nodes a.k.a. children
-            self.children = sortedcontainers.SortedList()
-            # if True, this is the last element of a set in the
-            # set-trie use this to store user data (a set
-            # element). Must be a hashable (i.e. hash(data) should
-            # work) and comparable/orderable (i.e. data1 < data2
-            # should work; see
-            # https://wiki.python.org/moin/HowTo/Sorting/) type.
-            self.flag_last = False
-            self.data = data
-            
-    def __init__(self, iterable=None):
+        __slots__ = ()
+
+    def __init__(self, iterable=None, intern_strings=False,
+                 intern_elements=False):
         """Initialize this set-trie. If iterable is specified, set-trie is
-           populated from its items.
+           populated from its items.  If intern_strings is True, str
+           elements are interned with sys.intern() when stored, so
+           equal strings occurring in many sets share one object.
+
+           If intern_elements is True, each distinct element is numbered
+           when first stored and the trie holds these int ids instead of
+           the elements, so that searches compare and hash small ints
+           only, which pays off for str or tuple elements.  The sets are
+           then iterated in the order of the ids of their elements, i.e.
+           the order in which the elements were first stored, instead of
+           in sorted order.
+
+           The sets in iterable are sorted all together first and then
+           inserted in a single pass, each one walking down only from
+           the end of the prefix it shares with the previous one.  All
+           the nodes created stay alive, so for large iterables, callers
+           that can afford it may speed this up further by pausing the
+           cyclic garbage collector around the call with gc.disable().
         """
         self.root = self.Node()
+        self.intern_strings = intern_strings
+        # element -> id map and list of the elements by id if
+        # intern_elements is True, else None
+        self._ids = {} if intern_elements else None
+        self._elements = [] if intern_elements else None
+        # (bits, maximal, minimal) built by _mask_index() and list built by
+        # freeze_bitset(), reset on insertion
+        self._masks = None
+        self._bitsets = None
+        # (views, nodes) lists of the sorted tuples of the stored sets and
+        # of their nodes in the order of iteration, recorded by the last
+        # complete iteration and reset on insertion
+        self._listing = None
+        # number of sets stored
+        self._size = 0
+        # set by freeze()
+        self._frozen = False
         if iterable is not None:
-            for s in iterable:
-                self.add(s)
+            self._insert_rows(sorted([self._stored_setarr(aset)
+                                      for aset in iterable]))
 
     def add(self, aset):
         """Add set aset to the container.  aset must be a sortable and
            iterable container type.
         """
-        self._add(self.root, iter(sorted(aset)))
-
-    @classmethod
-    def _add(cls, node, it):
-        """Recursive function used by self.insert().
-           node is a SetTrieNode object
-           it is an iterator over a sorted set"""
-        try:
-            data = next(it)
-            nextnode = None
-            try:
-                # find first child with this data
-                nextnode = node.children[node.children.index(
-                    cls.Node(data))]
-            except ValueError:  # not found
-                nextnode = cls.Node(data)  # create new node
-                node.children.add(nextnode)  # add to children & sort
-            cls._add(nextnode, it)  # recurse
-        except StopIteration:  # end of set to add
+        self._insert(aset)
+
+    def _insert(self, aset):
+        """Walk down the path of the sorted elements of aset, creating the
+           missing nodes, mark the last node of the path as the end of a
+           set and return it."""
+        if self._frozen:
+            raise TypeError('cannot add to a frozen set-trie')
+        self._masks = self._bitsets = self._listing = None
+        Node = self.Node
+        intern_strings = self.intern_strings
+        node = self.root
+        setarr = self._stored_setarr(aset)
+        if setarr:
+            last = setarr[-1]
+            if node.max_sub is None or node.max_sub < last:
+                node.max_sub = last
+        remaining = len(setarr)
+        for data in setarr:
+            if node.max_depth_below < remaining:
+                node.max_depth_below = remaining
+            remaining -= 1
+            children_map = node.children_map
+            nextnode = children_map.get(data)
+            if nextnode is None:  # not found
+                if intern_strings and isinstance(data, str):
+                    data = sys.intern(data)
+                nextnode = Node(data)  # create new node
+                keys = node.sorted_children  # add to children & sort
+                if not keys:  # first child, stop sharing the empties
+                    node.children_map = {data: nextnode}
+                    node.sorted_children = [data]
+                else:
+                    children_map[data] = nextnode
+                    if type(keys) is list:
+                        insort(keys, data)
+                        if len(keys) > SORTEDLIST_MIN_CHILDREN:
+                            node.sorted_children = (
+                                sortedcontainers.SortedList(keys))
+                    else:
+                        keys.add(data)
+            if nextnode.max_sub < last:
+                nextnode.max_sub = last
+            node = nextnode
+        if not node.flag_last:
             node.flag_last = True
+            self._size += 1
+        return node
+
+    def _insert_rows(self, rows):
+        """Used by __init__(), insert into this empty set-trie the sets
+           in list rows, each a list as returned by _stored_setarr(), in
+           lexicographic order.  Return the list of the nodes ending the
+           sets, in the same order.
+        """
+        self._masks = self._bitsets = self._listing = None
+        Node = self.Node
+        intern_strings = self.intern_strings
+        # nodes on the path of the previous set, starting at the root
+        nodes = [self.root]
+
+        def leave(depth):
+            # pop the nodes below depth, whose subtrees are complete,
+            # folding their subtree fields into their parents
+            while len(nodes) > depth + 1:
+                child = nodes.pop()
+                parent = nodes[-1]
+                if parent.max_depth_below <= child.max_depth_below:
+                    parent.max_depth_below = child.max_depth_below + 1
+                if (parent.max_sub is None or
+                        parent.max_sub < child.max_sub):
+                    parent.max_sub = child.max_sub
+
+        ends = []
+        prev = ()
+        for setarr in rows:
+            common = 0
+            shorter = min(len(setarr), len(prev))
+            while common < shorter and setarr[common] == prev[common]:
+                common += 1
+            leave(common)
+            node = nodes[-1]
+            # later sets sort after the earlier ones, so new children
+            # always go to the end of sorted_children
+            for data in setarr[common:]:
+                if intern_strings and isinstance(data, str):
+                    data = sys.intern(data)
+                child = Node(data)
+                keys = node.sorted_children
+                if not keys:
+                    node.children_map = {data: child}
+                    node.sorted_children = [data]
+                else:
+                    node.children_map[data] = child
+                    if type(keys) is list:
+                        keys.append(data)
+                        if len(keys) > SORTEDLIST_MIN_CHILDREN:
+                            node.sorted_children = (
+                                sortedcontainers.SortedList(keys))
+                    else:
+                        keys.add(data)
+                nodes.append(child)
+                node = child
+            if not node.flag_last:
+                node.flag_last = True
+                self._size += 1
+            ends.append(node)
+            prev = setarr
+        leave(0)
+        return ends
+
+    def _stored_setarr(self, aset):
+        """Return the sorted list of the elements of aset as stored in this
+           set-trie, numbering the new ones if intern_elements is on.
+        """
+        if self._ids is None:
+            return _sorted(aset)
+        element_id = self._element_id
+        return sorted([element_id(data) for data in aset])
+
+    def _element_id(self, data):
+        """Return the id of element data, numbering it if it is new."""
+        i = self._ids.get(data)
+        if i is None:
+            if self.intern_strings and isinstance(data, str):
+                data = sys.intern(data)
+            i = self._ids[data] = len(self._elements)
+            self._elements.append(data)
+        return i
+
+    def _setarr(self, aset):
+        """Return the sorted list of the elements of query set aset as
+           stored in this set-trie: the elements themselves, or their ids
+           if intern_elements is on, with -1 for elements not stored.
+        """
+        ids = self._ids
+        if ids is None:
+            return _sorted(aset)
+        return sorted([ids.get(data, -1) for data in aset])
+
+    def _walk(self, walker, *args):
+        """Return the pair (nodes, path) of the iterator over the nodes
+           yielded by walker(self.root, *args, path) and the list path
+           holding the elements of the set ending at the current node,
+           for _results().
+        """
+        path = []
+        nodes = walker(self.root, *args, path)
+        elements = self._elements
+        if elements is None:
+            return nodes, path
+        # walker's path holds ids, translate it for each node
+        keypath = []
+
+        def decoded():
+            for node in nodes:
+                keypath[:] = [elements[i] for i in path]
+                yield node
+
+        return decoded(), keypath
+
+    def _walk_all(self):
+        """Like self._walk(self._iter), for iterating over all stored sets,
+           but replaying the listing recorded by the last complete
+           iteration if there was no insertion since, instead of walking
+           the trie.
+        """
+        listing = self._listing
+        if listing is not None:
+            path = []
+
+            def replayed():
+                for view, node in zip(*listing):
+                    path[:] = view
+                    yield node
+
+            return replayed(), path
+        nodes, path = self._walk(self._iter)
+        size = self._size
+
+        def recorded():
+            views = []
+            ends = []
+            for node in nodes:
+                views.append(tuple(path))
+                ends.append(node)
+                yield node
+            if self._size == size:  # complete and still up to date
+                self._listing = views, ends
+
+        return recorded(), path
 
     def __contains__(self, aset):
         """Returns True iff this set-trie contains set aset.
@@ -119,123 +384,438 @@ class SetTrie(object):
            >>> {1, 3} in t
            True
         """
-        return self._contains(self.root, iter(sorted(aset)))
-
-    @classmethod
-    def _contains(cls, node, it):
-        """Recursive function used by self.contains()."""
-        try:
-            data = next(it)
-            try:
-                # find first child with this data
-                matchnode = node.children[node.children.index(
-                    cls.Node(data))]
-                return cls._contains(matchnode, it)  # recurse
-            except ValueError:  # not found
+        node = self.root
+        for data in self._setarr(aset):
+            node = node.children_map.get(data)
+            if node is None:  # not found
                 return False
-        except StopIteration:
-            return node.flag_last
+        return node.flag_last
+
+    def __len__(self):
+        """Returns the number of sets stored in this set-trie."""
+        return self._size
 
     def hassuperset(self, aset):
         """Returns True iff there is at least one set in this set-trie that is
-           the superset of set aset.
+           the superset of set aset.  Once the stored sets have been
+           encoded as bitmasks for batch_hassuperset() or
+           batch_hassubset(), the bitmasks of the sets ending at leaves
+           are scanned instead of searching the trie.
         """
+        setarr = self._setarr(aset)
+        root = self.root
+        # no stored set is long enough or holds elements beyond the
+        # smallest or largest ones stored
+        if setarr and (len(setarr) > root.max_depth_below or
+                       setarr[0] < root.sorted_children[0] or
+                       setarr[-1] > root.max_sub):
+            return False
+        if self._masks is not None:
+            bits, maximal, _ = self._masks
+            elements = self._elements
+            qmask = 0
+            for data in setarr:  # ids of unknown elements rejected above
+                bit = bits.get(data if elements is None else elements[data])
+                if bit is None:  # element not in any stored set
+                    return False
+                if qmask & bit:
+                    # repeated element, which the trie search never
+                    # matches, so leave it to give the same answer
+                    break
+                qmask |= bit
+            else:
+                return qmask == 0 or any((m & qmask) == qmask
+                                         for m in maximal)
         # TODO: if aset is not a set, convert it to a set first to
         # collapse multiply existing elements
-        return self._hassuperset(self.root, list(sorted(aset)), 0)
+        return self._hassuperset(root, setarr, 0)
 
     @classmethod
     def _hassuperset(cls, node, setarr, idx):
-        """Used by hassuperset()."""
-        if idx > len(setarr) - 1:
+        """Used by hassuperset(), iterative depth-first search for a node at
+           which all elements of setarr have been found.
+        """
+        n = len(setarr)
+        if idx == n:
             return True
-        found = False
-        for child in node.children:
-            # don't go to subtrees where current element cannot be
-            if child.data > setarr[idx]:
-                break
-            if child.data == setarr[idx]:
-                found = cls._hassuperset(child, setarr, idx + 1)
-            else:
-                found = cls._hassuperset(child, setarr, idx)
-            if found:
-                break
-        return found
-
-    def supersets(self, aset):
+        if n - idx > node.max_depth_below:
+            return False
+        # stack of iterators over (child, idx) pairs, one per level
+        supersets_children = cls._supersets_children
+        stack = [supersets_children(node, setarr, idx)]
+        while stack:
+            nextchild = next(stack[-1], None)
+            if nextchild is None:  # subtree done
+                stack.pop()
+                continue
+            child, idx = nextchild
+            if idx == n:
+                return True
+            stack.append(supersets_children(child, setarr, idx))
+        return False
+
+    def supersets(self, aset, as_tuples=False, as_frozensets=False):
         """Return an iterator over all sets in this set-trie that are (proper
-           or not proper) supersets of set aset.
+           or not proper) supersets of set aset.  If as_tuples is True,
+           the sets are returned as tuples of their sorted elements, which
+           are cheaper to build than sets; with intern_elements, the
+           elements are in the order of their ids instead, see
+           __init__().  If as_frozensets is True, they
+           are returned as frozensets, which can be hashed, e.g. to
+           deduplicate the results of several queries.  ValueError is
+           raised if both are True.
         """
-        path = []
-        return self._itersupersets(self.root, sorted(aset), path)
+        return self._results(
+            *self._walk(self._itersupersets, self._setarr(aset)),
+            keytype=self._keytype(as_tuples, as_frozensets))
 
     @classmethod
-    def _itersupersets(cls, node, setarr, path, *args):
-        """Used by itersupersets()."""
-        path.append(node.data)
-        if setarr:
-            current = setarr[0]
-            for child in node.children:
-                if child.data < current:
-                    yield from cls._itersupersets(child, setarr,
-                                                  path, *args)
-                elif child.data == current:
-                    yield from cls._itersupersets(child, setarr[1:],
-                                                  path, *args)
-                else:
-                    break
-        else:
-            if node.flag_last:
-                yield from cls._terminate(node, path[1:], *args)
-
-            for child in node.children:
-                yield from cls._iter(child, path, *args)
+    def _itersupersets(cls, node, setarr, path):
+        """Used by supersets(), iterative preorder traverse of the subtrees
+           that can hold supersets of setarr.  Yields the nodes ending
+           those supersets, with path holding the data of the nodes
+           below the root up to the yielded one.
+        """
+        n = len(setarr)
+        if n == 0:  # every set is a superset
+            yield from cls._iter(node, path)
+            return
+        # stack of iterators over (child, idx) pairs, one per level
+        supersets_children = cls._supersets_children
+        iter_all = cls._iter
+        stack = [supersets_children(node, setarr, 0)]
+        while stack:
+            nextchild = next(stack[-1], None)
+            if nextchild is None:  # subtree done
+                stack.pop()
+                if stack:
+                    path.pop()
+                continue
+            child, idx = nextchild
+            path.append(child.data)
+            if idx == n:
+                # all of setarr found on the path, every set below is a
+                # superset: plain traverse without further checks
+                yield from iter_all(child, path)
+                path.pop()
+                continue
+            stack.append(supersets_children(child, setarr, idx))
 
-        path.pop()
+    @classmethod
+    def _supersets_children(cls, node, setarr, idx):
+        """Used by _itersupersets(), yields the (child, idx) pairs of the
+           children of node that can lead to supersets of setarr, where
+           idx is the index of the first element of setarr not yet found
+           on the path to child.  idx must be less than len(setarr), the
+           callers walk the subtrees below the nodes where all elements
+           have been found without this function.
+        """
+        current = setarr[idx]
+        last = setarr[-1]
+        missing = len(setarr) - idx
+        children_map = node.children_map
+        keys = node.sorted_children
+        # children below current keep idx, the one equal to current (if
+        # any, the last in range) advances it
+        hi = bisect_right(keys, current)
+        eq = hi > 0 and keys[hi - 1] == current
+        for data in keys[:hi - 1 if eq else hi]:
+            child = children_map[data]
+            # skip subtrees without the largest element or too shallow
+            # to hold the elements still missing
+            if child.max_sub >= last and child.max_depth_below >= missing:
+                yield child, idx
+        if eq:
+            child = children_map[current]
+            if (child.max_sub >= last and
+                    child.max_depth_below >= missing - 1):
+                yield child, idx + 1
 
     def hassubset(self, aset):
         """Return True iff there is at least one set in this set-trie that is
            the (proper or not proper) subset of set aset.
         """
-        return self._hassubset(self.root, list(sorted(aset)), 0)
+        return self._hassubset(self.root, self._setarr(aset), 0,
+                               set() if self._frozen else None)
 
     @classmethod
-    def _hassubset(cls, node, setarr, idx):
-        """Used by hassubset()."""
-        if node.flag_last:
-            return True
-        if idx > len(setarr) - 1:
-            return False
-        found = False
-        try:
-            c = node.children.index(cls.Node(setarr[idx]))
-            found = cls._hassubset(node.children[c], setarr, idx + 1)
-        except ValueError:
-            pass
-        if not found:
-            return cls._hassubset(node, setarr, idx + 1)
-        else:
-            return True
+    def _hassubset(cls, node, setarr, idx, seen=None):
+        """Used by hassubset(), iterative depth-first search for a terminal
+           node reachable through elements of setarr only.  If seen is a
+           set, the (node, idx) pairs searched are added to it and not
+           searched again, for frozen set-tries where nodes are shared.
+        """
+        # stack of (node, idx) pairs where idx is the index of the first
+        # element of setarr that may still follow on the path
+        stack = [(node, idx)]
+        while stack:
+            pair = stack.pop()
+            if seen is not None:
+                if pair in seen:
+                    continue
+                seen.add(pair)
+            node, idx = pair
+            if node.flag_last:
+                return True
+            if not node.sorted_children:
+                continue
+            children_map = node.children_map
+            # no child can match query elements beyond the largest child
+            maxchild = node.sorted_children[-1]
+            for i in range(idx, len(setarr)):
+                data = setarr[i]
+                if data > maxchild:
+                    break
+                child = children_map.get(data)
+                if child is not None:
+                    stack.append((child, i + 1))
+        return False
 
-    def subsets(self, aset):
+    def subsets(self, aset, as_tuples=False, as_frozensets=False):
         """Return an iterator over all sets in this set-trie that are (proper
-           or not proper) subsets of set aset.
+           or not proper) subsets of set aset.  See supersets() for
+           as_tuples and as_frozensets.
         """
-        path = []
-        return self._itersubsets(self.root, aset, path)
+        return self._results(
+            *self._walk(self._itersubsets, self._setarr(aset)),
+            keytype=self._keytype(as_tuples, as_frozensets))
 
     @classmethod
-    def _itersubsets(cls, node, setarr, path, *args):
-        """Used by itersubsets()."""
-        path.append(node.data)
-
+    def _itersubsets(cls, node, setarr, path):
+        """Used by subsets(), iterative preorder traverse of the subtrees
+           whose elements are all in setarr.  Yields nodes like
+           _itersupersets().
+        """
         if node.flag_last:
-            yield from cls._terminate(node, path[1:], *args)
-        for child in node.children:
-            if child.data in setarr:
-                yield from cls._itersubsets(child, setarr, path, *args)
+            yield node
+        subsets_children = cls._subsets_children
+        stack = [subsets_children(node, setarr, 0)]
+        while stack:
+            nextchild = next(stack[-1], None)
+            if nextchild is None:  # subtree done
+                stack.pop()
+                if stack:
+                    path.pop()
+                continue
+            child, idx = nextchild
+            path.append(child.data)
+            if child.flag_last:
+                yield child
+            stack.append(subsets_children(child, setarr, idx))
 
-        path.pop()
+    @staticmethod
+    def _subsets_children(node, setarr, idx):
+        """Used by _itersubsets(), yields in sorted order the (child, idx)
+           pairs of the children of node whose data is in setarr[idx:],
+           where idx is the index following that data in setarr.
+        """
+        keys = node.sorted_children
+        if not keys:
+            return
+        n = len(setarr)
+        children_map = node.children_map
+        if len(keys) < n - idx:
+            # few children: merge them into the query, bisecting the
+            # rest of it for each
+            for data in keys:
+                idx = bisect_left(setarr, data, idx)
+                if idx == n:
+                    return
+                if setarr[idx] == data:
+                    idx += 1
+                    yield children_map[data], idx
+        else:
+            # short query: look its elements up among the children
+            maxchild = keys[-1]
+            for i in range(idx, n):
+                data = setarr[i]
+                if data > maxchild:
+                    return
+                if i > idx and data == setarr[i - 1]:  # repeated in query
+                    continue
+                child = children_map.get(data)
+                if child is not None:
+                    yield child, i + 1
+
+    def batch_hassuperset(self, queries):
+        """Return a list with the result of self.hassuperset(q) for each set
+           q in iterable queries.  The stored sets are encoded as
+           integer bitmasks once, so that each query is answered by
+           bitwise operations on them instead of a trie search.
+        """
+        bits, masks, _ = self._mask_index()
+        result = []
+        for q in queries:
+            qmask = 0
+            for data in q:
+                bit = bits.get(data)
+                if bit is None:  # element not in any stored set
+                    qmask = -1
+                    break
+                qmask |= bit
+            result.append(qmask == 0 or
+                          (qmask > 0 and
+                           any((m & qmask) == qmask for m in masks)))
+        return result
+
+    def batch_hassubset(self, queries):
+        """Return a list with the result of self.hassubset(q) for each set q
+           in iterable queries, see batch_hassuperset().
+        """
+        bits, _, masks = self._mask_index()
+        result = []
+        for q in queries:
+            qmask = 0
+            for data in q:
+                qmask |= bits.get(data, 0)
+            result.append(any((m | qmask) == qmask for m in masks))
+        return result
+
+    def freeze_bitset(self, universe_size=None):
+        """Return the sets stored in this set-trie, in the order of
+           iteration, as a list of int bitsets in which bit e is set iff
+           element e is in the set.  The elements must be ints in
+           range(universe_size), or non-negative ints if universe_size is
+           None, else ValueError is raised.  The list is kept for
+           bitset_supersets() until the next insertion.
+        """
+        def bit(data):
+            if (not isinstance(data, int) or data < 0 or
+                    (universe_size is not None and data >= universe_size)):
+                raise ValueError(
+                    'element {!r} out of bitset universe'.format(data))
+            return 1 << data
+
+        self._bitsets = list(self._iter_masks(bit))
+        return self._bitsets
+
+    @classmethod
+    def from_bitsets(cls, bitsets):
+        """Return a new set-trie holding the sets encoded by the ints in
+           iterable bitsets like in freeze_bitset(), built in a single
+           pass as in __init__().  ValueError is raised for negative ints.
+        """
+        rows = []
+        for bitset in bitsets:
+            if bitset < 0:
+                raise ValueError('negative bitset {!r}'.format(bitset))
+            setarr = []
+            while bitset:
+                low = bitset & -bitset
+                setarr.append(low.bit_length() - 1)
+                bitset ^= low
+            rows.append(setarr)
+        rows.sort()
+        trie = cls()
+        trie._insert_rows(rows)
+        return trie
+
+    def hassuperset_bitset(self, query_bits):
+        """Return True iff there is at least one set among the bitsets of
+           the stored sets (see freeze_bitset()) that is a superset of the
+           set encoded by int bitset query_bits.
+        """
+        bitsets = self._bitsets
+        if bitsets is None:
+            bitsets = self.freeze_bitset()
+        return any((b & query_bits) == query_bits for b in bitsets)
+
+    def bitset_supersets(self, query_bits):
+        """Return the list of bitsets of the stored sets (see freeze_bitset())
+           that are supersets of the set encoded by int bitset query_bits.
+        """
+        bitsets = self._bitsets
+        if bitsets is None:
+            bitsets = self.freeze_bitset()
+        return [b for b in bitsets if (b & query_bits) == query_bits]
+
+    def hassubset_bitset(self, query_bits):
+        """Return True iff there is at least one set among the bitsets of
+           the stored sets (see freeze_bitset()) that is a subset of the
+           set encoded by int bitset query_bits.
+        """
+        bitsets = self._bitsets
+        if bitsets is None:
+            bitsets = self.freeze_bitset()
+        return any((b & query_bits) == b for b in bitsets)
+
+    def bitset_subsets(self, query_bits):
+        """Return the list of bitsets of the stored sets (see freeze_bitset())
+           that are subsets of the set encoded by int bitset query_bits.
+        """
+        bitsets = self._bitsets
+        if bitsets is None:
+            bitsets = self.freeze_bitset()
+        return [b for b in bitsets if (b & query_bits) == b]
+
+    def _mask_index(self):
+        """Return a triple (bits, maximal, minimal) where bits maps each
+           element stored in this set-trie to a distinct power of 2, and
+           maximal and minimal are lists of stored sets encoded as the sum
+           of the bits of their elements: the sets ending at leaves, of
+           which every stored set is a subset, and the sets with no other
+           stored set on their path, of which every stored set is a
+           superset.  Built on first use after each insertion.
+        """
+        if self._masks is None:
+            bits = {}
+            maximal = []
+            minimal = []
+            elements = self._elements
+            children = self._children
+            root = self.root
+            if root.flag_last:
+                minimal.append(0)
+                if not root.sorted_children:
+                    maximal.append(0)
+            # stack of (children iterator, mask of the path, whether a
+            # set ends on the path)
+            stack = [(children(root), 0, root.flag_last)]
+            while stack:
+                childiter, mask, covered = stack[-1]
+                child = next(childiter, None)
+                if child is None:  # subtree done
+                    stack.pop()
+                    continue
+                data = child.data
+                if elements is not None:
+                    data = elements[data]
+                bit = bits.get(data)
+                if bit is None:
+                    bit = bits[data] = 1 << len(bits)
+                childmask = mask | bit
+                if child.flag_last and not covered:
+                    minimal.append(childmask)
+                if child.sorted_children:
+                    stack.append((children(child), childmask,
+                                  covered or child.flag_last))
+                else:  # leaves always end sets
+                    maximal.append(childmask)
+            self._masks = bits, maximal, minimal
+        return self._masks
+
+    def _iter_masks(self, bit):
+        """Yield the sets stored in this set-trie, in the order of iteration,
+           encoded as the bitwise or of bit(data) over their elements.
+        """
+        elements = self._elements
+        if self.root.flag_last:
+            yield 0
+        stack = [(self._children(self.root), 0)]
+        while stack:
+            children, mask = stack[-1]
+            child = next(children, None)
+            if child is None:  # subtree done
+                stack.pop()
+                continue
+            data = child.data
+            if elements is not None:
+                data = elements[data]
+            childmask = mask | bit(data)
+            if child.flag_last:
+                yield childmask
+            if child.sorted_children:
+                stack.append((self._children(child), childmask))
 
     def __iter__(self):
         """Returns an iterator over the sets stored in this set-trie (with
@@ -250,19 +830,94 @@ class SetTrie(object):
            >>>   print(s)
            {1, 2}
            {2, 3, 4}
+
+           Once an iteration has run to the end, the sets are kept
+           until the next insertion, and further iterations build them
+           from that listing instead of walking the trie.
         """
-        path = []
-        yield from self._iter(self.root, path)
+        if self._listing is not None:
+            return map(set, self._listing[0])
+        return self._results(*self._walk_all())
 
     @classmethod
-    def _iter(cls, node, path, *args):
-        """Recursive function used by self.__iter__()."""
-        path.append(node.data)
+    def _iter(cls, node, path):
+        """Used by self.__iter__(), iterative preorder traverse of the
+           subtree rooted at node.  Yields nodes like _itersupersets().
+        """
         if node.flag_last:
-            yield from cls._terminate(node, path[1:], *args)
-        for child in node.children:
-            yield from cls._iter(child, path, *args)
-        path.pop()
+            yield node
+        children = cls._children
+        stack = [children(node)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:  # subtree done
+                stack.pop()
+                if stack:
+                    path.pop()
+                continue
+            path.append(child.data)
+            if child.flag_last:
+                yield child
+            if child.sorted_children:
+                stack.append(children(child))
+            else:  # leaf, done
+                path.pop()
+
+    def freeze(self):
+        """Make this set-trie read-only and store each of its distinct
+           subtrees only once, turning the trie into a directed acyclic
+           graph.  Sets ending in equal tails share the nodes of the tails,
+           most of all the leaves, so large set-tries take much less
+           memory.  The sorted children data are turned into tuples.
+           Afterwards, adding sets raises TypeError.  Copies made
+           by from_arrays() or pickling are not frozen.
+        """
+        if self._frozen:
+            return
+        self._frozen = True
+        self._listing = None
+        nodes = [self.root]
+        children = self._children
+        for node in nodes:  # nodes grows while iterated
+            nodes.extend(children(node))
+        freeze_key = self._freeze_key
+        shared = {}  # key of a subtree -> its node kept
+        canonical = {}  # node -> the node kept in its place
+        # children are numbered after their parents, so visit them first
+        for node in reversed(nodes):
+            keys = node.sorted_children
+            if keys:
+                # read-only from now on, so a tuple, more compact than a
+                # list and much faster to index than a SortedList
+                keys = node.sorted_children = tuple(keys)
+                children_map = node.children_map
+                for data in keys:
+                    children_map[data] = canonical[children_map[data]]
+                childids = tuple([id(children_map[data]) for data in keys])
+            else:
+                childids = ()
+            data = node.data
+            key = (type(data), data, node.flag_last, freeze_key(node),
+                   childids)
+            canonical[node] = shared.setdefault(key, node)
+
+    @staticmethod
+    def _freeze_key(node):
+        """Used by freeze(), return what nodes must share besides their data,
+           flag and children to be merged."""
+        return None
+
+    def iter_views(self):
+        """Returns an iterator over the sets stored in this set-trie in the
+           same order as self.__iter__(), but with each set returned as
+           the tuple of its sorted elements, which is cheaper to build
+           than a set.  With intern_elements, the elements are in the
+           order of their ids instead, see __init__().
+        """
+        if self._listing is not None:
+            return iter(self._listing[0])
+        nodes, path = self._walk_all()
+        return (tuple(path) for _ in nodes)
 
     def pprint(self, tabchr=' ', tabsize=2, stream=sys.stdout):
         """Print a mirrored 90-degree rotation of the nodes in this trie to
@@ -271,19 +926,138 @@ class SetTrie(object):
            determine the indentation: at tree level n, n*tabsize
            tabchar characters will be used.
         """
-        self._printtree(self.root, 0, tabchr, tabsize, stream)
+        lines = []
+        suffix = self._printsuffix
+        elements = self._elements
+        # iterative preorder traverse, children pushed in reverse order
+        stack = [(self.root, 0)]
+        while stack:
+            node, level = stack.pop()
+            data = node.data
+            if elements is not None and level:
+                data = elements[data]
+            lines.append(str(data).rjust(len(repr(data)) + level * tabsize,
+                                         tabchr) + suffix(node))
+            children_map = node.children_map
+            stack.extend((children_map[childdata], level + 1)
+                         for childdata in reversed(node.sorted_children))
+        lines.append('')
+        stream.write('\n'.join(lines))
+
+    @staticmethod
+    def _printsuffix(node):
+        """Used by self.pprint(), the text printed after the data of node."""
+        return '#' if node.flag_last else ''
+
+    @staticmethod
+    def _children(node):
+        """Return an iterator over the child nodes of node in sorted
+           order of their data."""
+        return map(node.children_map.__getitem__, node.sorted_children)
+
+    def to_arrays(self):
+        """Return the structure of this set-trie as a dict of flat arrays,
+           with the nodes numbered in breadth-first order from 0 for the
+           root, so that the children of each node are numbered
+           consecutively:
+
+           'child_first_index': array of len(nodes) + 1 ints, the
+                                children of node i are the nodes from
+                                child_first_index[i] to
+                                child_first_index[i + 1] - 1
+           'child_data': the data of node i at index i - 1, an array of
+                         ints if all elements are ints, else a list
+           'flag_last': bytearray, 1 at index i iff node i ends a set
+           'elements': only with intern_elements on, the list of the
+                       elements by id, child_data holding their ids
+
+           The arrays are compact to pickle or store, see from_arrays().
+        """
+        nodes = [self.root]
+        child_first_index = array('q')
+        child_data = []
+        flag_last = bytearray()
+        children = self._children
+        for node in nodes:  # nodes grows while iterated
+            child_first_index.append(len(nodes))
+            flag_last.append(node.flag_last)
+            for child in children(node):
+                nodes.append(child)
+                child_data.append(child.data)
+        child_first_index.append(len(nodes))
+        if all(type(data) is int for data in child_data):
+            try:
+                child_data = array('q', child_data)
+            except OverflowError:
+                pass
+        arrays = {'child_first_index': child_first_index,
+                  'child_data': child_data,
+                  'flag_last': flag_last}
+        if self._elements is not None:
+            arrays['elements'] = list(self._elements)
+        self._save_node_arrays(arrays, nodes)
+        return arrays
 
     @classmethod
-    def _printtree(cls, node, level, tabchr, tabsize, stream):
-        """Used by self.printTree(), recursive preorder traverse and printing
-           of trie node
+    def from_arrays(cls, arrays, intern_strings=False):
+        """Return a new set-trie with the structure in dict arrays as
+           returned by to_arrays(), built in one pass over the nodes
+           without sorting or searching.
         """
-        print(str(node.data).rjust(len(repr(node.data)) + level *
-                                   tabsize, tabchr) +
-              ('#' if node.flag_last else ''),
-              file=stream)
-        for child in node.children:
-            cls._printtree(child, level + 1, tabchr, tabsize, stream)
+        elements = arrays.get('elements')
+        trie = cls(intern_strings=intern_strings,
+                   intern_elements=elements is not None)
+        if elements is not None:
+            trie._elements = list(elements)
+            trie._ids = {data: i for i, data in enumerate(elements)}
+        Node = cls.Node
+        child_first_index = arrays['child_first_index']
+        child_data = arrays['child_data']
+        flag_last = arrays['flag_last']
+        nodes = [trie.root]
+        nodes.extend(Node(data) for data in child_data)
+        for i, node in enumerate(nodes):
+            node.flag_last = bool(flag_last[i])
+            first = child_first_index[i]
+            if first == child_first_index[i + 1]:  # leaf
+                continue
+            keys = child_data[first - 1:child_first_index[i + 1] - 1]
+            node.children_map = dict(zip(keys, nodes[first:]))
+            if len(keys) > SORTEDLIST_MIN_CHILDREN:
+                keys = sortedcontainers.SortedList(keys)
+            else:
+                keys = list(keys)
+            node.sorted_children = keys
+        # children are numbered after their parents, so compute the
+        # subtree fields bottom-up
+        for i in range(len(nodes) - 1, -1, -1):
+            node = nodes[i]
+            first = child_first_index[i]
+            last = child_first_index[i + 1]
+            if first < last:
+                childnodes = nodes[first:last]
+                node.max_sub = max(c.max_sub for c in childnodes)
+                node.max_depth_below = 1 + max(
+                    c.max_depth_below for c in childnodes)
+        trie._size = sum(flag_last)
+        trie._load_node_arrays(arrays, nodes)
+        return trie
+
+    def _save_node_arrays(self, arrays, nodes):
+        """Used by to_arrays(), add the arrays of any further node fields
+           of the nodes numbered as in list nodes to dict arrays."""
+        pass
+
+    def _load_node_arrays(self, arrays, nodes):
+        """Used by from_arrays(), set further node fields of the nodes
+           numbered as in list nodes from dict arrays."""
+        pass
+
+    def __reduce__(self):
+        # pickle as flat arrays, which also avoids the deep recursion
+        # of pickling the nodes as nested objects
+        return (self.__class__.from_arrays,
+                (self.to_arrays(), self.intern_strings))
 
     def __str__(self):
         return str(list(self))
@@ -292,8 +1066,21 @@ class SetTrie(object):
         return str(self)
 
     @staticmethod
-    def _terminate(node, path):
-        yield set(path)
+    def _keytype(as_tuples, as_frozensets):
+        """Return the type the sets are returned as, see supersets()."""
+        if as_tuples:
+            if as_frozensets:
+                raise ValueError('as_tuples and as_frozensets are both True')
+            return tuple
+        return frozenset if as_frozensets else set
+
+    @staticmethod
+    def _results(nodes, path, keytype=set):
+        """Return an iterator over the sets ending at the nodes yielded by
+           nodes, an iterator from one of the traversal functions
+           sharing list path, built by calling keytype on path.
+        """
+        return (keytype(path) for _ in nodes)
 
 
 class SetTrieMap(SetTrie):
@@ -329,84 +1116,58 @@ class SetTrieMap(SetTrie):
            from the outside.
         """
 
+        __slots__ = ('value',)
+
         def __init__(self, data=None, value=None):
-            # child nodes a.k.a. children
-            self.children = sortedcontainers.SortedList()
-            # if True, this is the last element of a key set store a
-            # member element of the key set. Must be a hashable
-            # (i.e. hash(data) should work) and comparable/orderable
-            # (i.e. data1 < data2 should work; see
-            # https://wiki.python.org/moin/HowTo/Sorting/) type.
-            self.flag_last = False
-            self.data = data
+            super().__init__(data)
             # the value associated to the key set if flag_last ==
             # True, otherwise None
-            self.value = None
+            self.value = value
 
-    def __init__(self, iterable=None):
+    def __init__(self, iterable=None, intern_strings=False,
+                 intern_elements=False):
         """Set up this SetTrieMap object.  If iterable is specified, it must
            be an iterable of (keyset, value) pairs from which set-trie
-           is populated.
+           is populated, in a single pass like in SetTrie.__init__().
+           Pairs with equal keysets are assigned in their order in
+           iterable.  See SetTrie.__init__() for intern_strings and
+           intern_elements.
         """
-        self.root = self.Node()
+        super().__init__(intern_strings=intern_strings,
+                         intern_elements=intern_elements)
         if iterable is not None:
-            for key, value in iterable:
-                self[key] = value
+            pairs = sorted([(self._stored_setarr(key), value)
+                            for key, value in iterable], key=itemgetter(0))
+            nodes = self._insert_rows([key for key, _ in pairs])
+            node_value = self._node_value
+            for node, (_, value) in zip(nodes, pairs):
+                node_value(node, value)
 
     def __setitem__(self, akey, avalue):
         """Add key akey with associated value avalue to the container.
            akey must be a sortable and iterable container type."""
-        self._assign(self.root, iter(sorted(akey)), avalue)
-
-    @classmethod
-    def _assign(cls, node, it, val):
-        """Recursive function used by self.assign()."""
-        try:
-            data = next(it)
-            nextnode = None
-            try:
-                # find first child with this data
-                nextnode = node.children[node.children.index(
-                    cls.Node(data))]
-            except ValueError:  # not found
-                nextnode = cls.Node(data)  # create new node
-                node.children.add(nextnode)  # add to children & sort
-            cls._assign(nextnode, it, val)  # recurse
-        except StopIteration:  # end of set to add
-            node.flag_last = True
-            cls._node_value(node, val)
+        node = self._insert(akey)
+        self._node_value(node, avalue)
 
     def __getitem__(self, keyset):
-        return self._get(self.root, iter(sorted(keyset)))
+        value = self.get(keyset, _MISSING)
+        if value is _MISSING:
+            raise KeyError(keyset)
+        return value
 
     def get(self, keyset, default=None):
         """Return the value associated to keyset if keyset is in this
            SetTrieMap, else default.
         """
-        try:
-            return self[keyset]
-        except KeyError:
-            return default
-
-    @classmethod
-    def _get(cls, node, it):
-        """Recursive function used by self.get()."""
-        try:
-            data = next(it)
-            try:
-                # find first child with this data
-                matchnode = node.children[node.children.index(
-                    cls.Node(data))]
-                return cls._get(matchnode, it)  # recurse
-            except ValueError:
-                raise KeyError
-        except StopIteration:
-            if node.flag_last:
-                return node.value
-            else:
-                raise KeyError
-
-    def supersets(self, aset, mode=None):
+        node = self.root
+        for data in self._setarr(keyset):
+            node = node.children_map.get(data)
+            if node is None:  # not found
+                return default
+        return node.value if node.flag_last else default
+
+    def supersets(self, aset, mode=None, as_tuples=False,
+                  as_frozensets=False):
         """Return an iterator over all (keyset, value) pairs from this
            SetTrieMap for which set keyset is a superset (proper or
            not proper) of set aset.  If mode is not None, the
@@ -419,14 +1180,16 @@ class SetTrieMap(SetTrie):
                           of aset
 
            If mode is neither of 'keys', 'values' or None, behavior is
-           equivalent to mode=None.
-
+           equivalent to mode=None.  If as_tuples is True, the keysets
+           are returned as tuples of their sorted elements (in the order
+           of their ids with intern_elements), and if as_frozensets is
+           True, as frozensets, see SetTrie.supersets().
         """
-        path = []
-        return self._itersupersets(self.root, sorted(aset), path,
-                                   mode)
+        return self._results(
+            *self._walk(self._itersupersets, self._setarr(aset)), mode,
+            self._keytype(as_tuples, as_frozensets))
 
-    def subsets(self, aset, mode=None):
+    def subsets(self, aset, mode=None, as_tuples=False, as_frozensets=False):
         """Return an iterator over pairs (keyset, value) from this SetTrieMap
            for which keyset is (proper or not proper) subset of set aset.
            If mode is not None, the following values are allowed:
@@ -438,12 +1201,14 @@ class SetTrieMap(SetTrie):
                           are associated to keysets that are subsets of aset
 
            If mode is neither of 'keys', 'values' or None, behavior is
-           equivalent to mode=None.
+           equivalent to mode=None.  See supersets() for as_tuples and
+           as_frozensets.
         """
-        path = []
-        return self._itersubsets(self.root, aset, path, mode)
+        return self._results(
+            *self._walk(self._itersubsets, self._setarr(aset)), mode,
+            self._keytype(as_tuples, as_frozensets))
 
-    def iter(self, mode=None):
+    def iter(self, mode=None, as_tuples=False, as_frozensets=False):
         """Returns an iterator to all (keyset, value) pairs stored in this
            SetTrieMap (using pre-order tree traversal).  The pairs are
            returned sorted to their keys, which are also sorted.  If
@@ -457,10 +1222,11 @@ class SetTrieMap(SetTrie):
                           of aset
 
            If mode is neither of 'keys', 'values' or None, behavior is
-           equivalent to mode=None.
+           equivalent to mode=None.  See supersets() for as_tuples and
+           as_frozensets.
         """
-        path = []
-        yield from self._iter(self.root, path, mode)
+        return self._results(*self._walk_all(), mode,
+                             self._keytype(as_tuples, as_frozensets))
 
     def keys(self):
         """Alias for self.iter(mode='keys')."""
@@ -478,31 +1244,41 @@ class SetTrieMap(SetTrie):
         """Same as self.iter(mode='keys')."""
         return self.keys()
 
+    @staticmethod
     def _node_value(node, value):
         node.value = value
 
-    @classmethod
-    def _printtree(cls, node, level, tabchr, tabsize, stream):
-        """Used by self.printTree(), recursive preorder traverse and printing
-           of trie node
-        """
-        print((str(node.data).rjust(len(repr(node.data)) + level * tabsize,
-                                    tabchr) +
-               (': {}'.format(repr(node.value)) if
-                node.flag_last else
-                '')),
-              file=stream)
-        for child in node.children:
-            cls._printtree(child, level + 1, tabchr, tabsize, stream)
+    @staticmethod
+    def _freeze_key(node):
+        # only merge nodes holding the very same value
+        return id(node.value)
+
+    def _save_node_arrays(self, arrays, nodes):
+        """Add the list 'values' of the values of the nodes to arrays."""
+        arrays['values'] = [node.value for node in nodes]
+
+    def _load_node_arrays(self, arrays, nodes):
+        """Set the values of the nodes from list arrays['values']."""
+        for node, value in zip(nodes, arrays['values']):
+            node.value = value
 
     @staticmethod
-    def _terminate(node, path, mode):
+    def _printsuffix(node):
+        """Used by self.pprint(), the text printed after the data of node."""
+        return ': {}'.format(repr(node.value)) if node.flag_last else ''
+
+    @staticmethod
+    def _results(nodes, path, mode=None, keytype=set):
+        """Return an iterator over the keysets, values or (keyset, value)
+           pairs depending on mode of the nodes yielded by nodes, see
+           SetTrie._results().
+        """
         if mode == 'keys':
-            yield set(path)
+            return (keytype(path) for _ in nodes)
         elif mode == 'values':
-            yield node.value
+            return (node.value for node in nodes)
         else:
-            yield (set(path), node.value)
+            return ((keytype(path), node.value) for node in nodes)
 
 
 
@@ -534,29 +1310,43 @@ class SetTrieMultiMap(SetTrieMap):
 
     """
 
-    def _node_value(node, value):
-        if node.value is None:
-            node.value = []
-        node.value.append(value)
-
-    @classmethod
-    def _printtree(cls, node, level, tabchr, tabsize, stream):
-        """Used by self.printTree(), recursive preorder traverse and printing
-           of trie node
+    def bulk_add(self, pairs):
+        """Add the values of iterable pairs of (keyset, value) to the
+           container.  Values are grouped by keyset first, so the trie is
+           walked once per distinct keyset instead of once per pair.
         """
-        print((str(node.data).rjust(len(repr(node.data)) + level * tabsize,
-                                    tabchr) +
-               (': {}'.format(repr(node.value)) if node.flag_last else '')),
-              file=stream)
-        for child in node.children:
-            cls._printtree(child, level + 1, tabchr, tabsize, stream)
+        groups = {}
+        for key, value in pairs:
+            sortedkey = tuple(_sorted(key))
+            values = groups.get(sortedkey)
+            if values is None:
+                groups[sortedkey] = [value]
+            else:
+                values.append(value)
+        for sortedkey, values in groups.items():
+            node = self._insert(sortedkey)
+            if node.value is None:
+                node.value = values
+            else:
+                node.value.extend(values)
 
     @staticmethod
-    def _terminate(node, path, mode):
+    def _node_value(node, value):
+        values = node.value
+        if values is None:
+            values = node.value = []
+        values.append(value)
+
+    @staticmethod
+    def _results(nodes, path, mode=None, keytype=set):
+        """Like SetTrieMap._results(), but with one value or (keyset, value)
+           pair per value associated to a keyset.
+        """
         if mode == 'keys':
-            yield set(path)
+            return (keytype(path) for _ in nodes)
         elif mode == 'values':
-            yield from node.value
+            return (val for node in nodes for val in node.value)
         else:
-            yield from [(set(path), val) for val in node.value]
+            return ((keytype(path), val)
+                    for node in nodes for val in node.value)
 
@@ -8,7 +8,7 @@ https://sites.google.com/site/mmihaltz/
 """
 
 import unittest
-from settrie import SetTrie, SetTrieMap, SetTrieMultiMap
+from settrie import SetTrie, SetTrieMap, SetTrieMultiMap, PreparedQuery
 
 
 class TestSetTrie(unittest.TestCase):
@@ -56,6 +56,47 @@ class TestSetTrie(unittest.TestCase):
 
   def test_aslist(self):
     self.assertEqual(list(self.t), [{1, 2, 4}, {1, 3}, {1, 3, 5}, {1, 4}, {2, 3, 5}, {2, 4}])
+
+  def test_iter_views(self):
+    self.assertEqual(list(self.t.iter_views()),
+                     [(1, 2, 4), (1, 3), (1, 3, 5), (1, 4), (2, 3, 5), (2, 4)])
+    self.assertEqual(list(SetTrie([set()]).iter_views()), [()])
+
+  def test_iter_repeated(self):
+    sets = [{1, 2, 4}, {1, 3}, {1, 3, 5}, {1, 4}, {2, 3, 5}, {2, 4}]
+    it = iter(self.t)
+    next(it)
+    self.assertEqual(list(self.t), sets)
+    self.assertEqual(list(self.t), sets)
+    self.assertEqual(list(self.t.iter_views())[0], (1, 2, 4))
+    self.t.add({1, 2})
+    self.assertEqual(list(self.t), [{1, 2}] + sets)
+
+  def test_arrays(self):
+    a = self.t.to_arrays()
+    self.assertEqual(list(a['child_first_index']), [1, 3, 6, 8, 9, 10, 10, 11, 11, 11, 11, 11])
+    self.assertEqual(list(a['child_data']), [1, 2, 2, 3, 4, 3, 4, 4, 5, 5])
+    self.assertEqual(a['flag_last'], bytearray([0, 0, 0, 0, 1, 1, 0, 1, 1, 1, 1]))
+    t2 = SetTrie.from_arrays(a)
+    self.assertEqual(list(t2), list(self.t))
+    self.assertEqual(len(t2), 6)
+    self.assertEqual(list(t2.supersets({3, 5})), [{1, 3, 5}, {2, 3, 5}])
+    self.assertFalse(t2.hassuperset({2, 4, 5}))
+
+  def test_pickle(self):
+    import pickle
+    t2 = pickle.loads(pickle.dumps(self.t))
+    self.assertEqual(list(t2), list(self.t))
+    t3 = pickle.loads(pickle.dumps(SetTrie([{'a', 'b'}, {'c'}])))
+    self.assertEqual(list(t3), [{'a', 'b'}, {'c'}])
+
+  def test_len(self):
+    self.assertEqual(len(self.t), 6)
+    self.t.add({1, 3})
+    self.assertEqual(len(self.t), 6)
+    self.t.add({1})
+    self.assertEqual(len(self.t), 7)
+    self.assertEqual(len(SetTrie()), 0)
     
   def test_str(self):
     self.assertEqual(str(self.t), "[{1, 2, 4}, {1, 3}, {1, 3, 5}, {1, 4}, {2, 3, 5}, {2, 4}]")
@@ -71,16 +112,106 @@ class TestSetTrie(unittest.TestCase):
     self.assertFalse({1} in self.t)
     self.assertTrue({1, 3, 5} in self.t)
     self.assertFalse({1, 3, 5, 7} in self.t)
+
+  def test_add_long_set(self):
+    # deeper than the default recursion limit
+    self.t.add(range(5000))
+    self.assertTrue(set(range(5000)) in self.t)
+    self.assertFalse(set(range(4999)) in self.t)
+    self.assertTrue(self.t.hassuperset(range(5000)))
+    self.assertTrue(SetTrie([range(5000)]).hassubset(range(5000)))
+    self.assertEqual(list(self.t.supersets({4999})), [set(range(5000))])
+    self.assertIn(set(range(5000)), list(self.t.subsets(range(5000))))
+    self.assertIn(set(range(5000)), list(self.t))
     
+  def test_intern_strings(self):
+    t = SetTrie([{'a', ''.join(['z', 'z'])}, {''.join(['z', 'z'])}],
+                intern_strings=True)
+    zz = [e for s in t for e in s if e == 'zz']
+    self.assertEqual(len(zz), 2)
+    self.assertIs(zz[0], zz[1])
+
+  def test_init_bulk(self):
+    sets = [{1, 3}, {1, 3, 5}, {1, 4}, {1, 2, 4}, {2, 4}, {2, 3, 5}, {1, 3}]
+    t = SetTrie(sets)
+    self.assertEqual(list(t), list(self.t))
+    self.assertEqual(len(t), 6)
+    self.assertEqual(t.to_arrays(), self.t.to_arrays())
+    self.assertTrue(t.hassuperset({3, 5}))
+    self.assertEqual(list(t.supersets({1, 4})), [{1, 2, 4}, {1, 4}])
+    self.assertEqual(list(SetTrie([])), [])
+    # a set-trie built from a generator matches one grown by add()
+    grown = SetTrie()
+    for s in sets:
+      grown.add(s)
+    self.assertEqual(str(SetTrie(iter(sets))), str(grown))
+
+  def test_freeze(self):
+    import pickle
+    sets = list(self.t)
+    self.t.freeze()
+    self.assertEqual(list(self.t), sets)
+    self.assertEqual(len(self.t), 6)
+    # the leaves ending {1, 4} and {2, 4} are merged
+    self.assertIs(self.t.root.children_map[1].children_map[4],
+                  self.t.root.children_map[2].children_map[4])
+    self.assertTrue({1, 3} in self.t)
+    self.assertTrue(self.t.hassubset({1, 2, 4}))
+    self.assertFalse(self.t.hassubset({1, 2}))
+    self.assertEqual(list(self.t.supersets({4})), [{1, 2, 4}, {1, 4}, {2, 4}])
+    self.assertEqual(self.t.root.sorted_children, (1, 2))
+    self.assertRaises(TypeError, self.t.add, {6})
+    self.assertEqual(list(pickle.loads(pickle.dumps(self.t))), sets)
+
+  def test_intern_elements(self):
+    t = SetTrie([{'b', 'c'}, {'a', 'b', 'c'}, {'a'}], intern_elements=True)
+    self.assertEqual(len(t), 3)
+    self.assertTrue({'c', 'b'} in t)
+    self.assertFalse({'b'} in t)
+    self.assertFalse({'b', 'd'} in t)
+    self.assertTrue(t.hassuperset({'a', 'c'}))
+    self.assertFalse(t.hassuperset({'a', 'd'}))
+    self.assertTrue(t.hassubset({'a', 'd'}))
+    self.assertFalse(t.hassubset({'c', 'd'}))
+    self.assertEqual(sorted(map(sorted, t.supersets({'b'}))),
+                     [['a', 'b', 'c'], ['b', 'c']])
+    # tuples follow the ids, i.e. the order the elements were first stored
+    self.assertEqual(list(SetTrie([('c', 'b'), ('a', 'b', 'c')], intern_elements=True)
+                          .supersets({'b'}, as_tuples=True)),
+                     [('c', 'b'), ('c', 'b', 'a')])
+    self.assertEqual(sorted(map(sorted, t.subsets({'a', 'b', 'c', 'd'}))),
+                     [['a'], ['a', 'b', 'c'], ['b', 'c']])
+    self.assertEqual(t.batch_hassuperset([{'c'}, {'d'}]), [True, False])
+    self.assertTrue(t.hassuperset(x for x in ['a', 'c']))
+    self.assertFalse(t.hassuperset({'a', 'd'}))
+    self.assertEqual(sorted(map(sorted, t.from_arrays(t.to_arrays()))),
+                     sorted(map(sorted, t)))
+
   def test_hassuperset(self):
     self.assertTrue(self.t.hassuperset({3, 5}))
     self.assertFalse(self.t.hassuperset({6}))
     self.assertTrue(self.t.hassuperset({1, 2, 4}))
     self.assertFalse(self.t.hassuperset({2, 4, 5} ))
+    self.assertFalse(self.t.hassuperset({0, 1}))
+    self.assertFalse(self.t.hassuperset({1, 2, 3, 4}))
+    self.assertTrue(self.t.hassuperset(set()))
+    self.assertFalse(SetTrie().hassuperset({1}))
+    self.assertTrue(SetTrie([set()]).hassuperset(set()))
+    # the root holds the largest element stored however the trie is built
+    self.assertEqual(self.t.root.max_sub, 5)
+    self.t.add({7})
+    self.assertEqual(self.t.root.max_sub, 7)
+    self.assertTrue(self.t.hassuperset({7}))
+    self.assertEqual(SetTrie.from_arrays(self.t.to_arrays()).root.max_sub, 7)
     
   def test_supersets(self):
     self.assertEqual(list(self.t.supersets({3, 5})), [{1, 3, 5}, {2, 3, 5}])
     self.assertEqual(list(self.t.supersets({1, 4})), [{1, 2, 4}, {1, 4}])
+    self.assertEqual(list(self.t.supersets({1, 4}, as_tuples=True)), [(1, 2, 4), (1, 4)])
+    found = list(self.t.supersets({1, 4}, as_frozensets=True))
+    self.assertEqual(found, [{1, 2, 4}, {1, 4}])
+    self.assertTrue(all(type(s) is frozenset for s in found))
+    self.assertRaises(ValueError, self.t.supersets, {1, 4}, as_tuples=True, as_frozensets=True)
     self.assertEqual(list(self.t.supersets({1, 3, 5})),  [{1, 3, 5}])
     self.assertEqual(list(self.t.supersets({2})),  [{1, 2, 4}, {2, 3, 5}, {2, 4}])
     self.assertEqual(list(self.t.supersets({1})),  [{1, 2, 4}, {1, 3}, {1, 3, 5}, {1, 4}])
@@ -96,8 +227,63 @@ class TestSetTrie(unittest.TestCase):
     self.assertFalse(self.t.hassubset({3, 4, 5}))
     self.assertFalse(self.t.hassubset({6, 7, 8, 9, 1000}))
 
+  def test_prepared_query(self):
+    q = PreparedQuery({5, 3})
+    self.assertFalse(q in self.t)
+    self.assertTrue(self.t.hassuperset(q))
+    self.assertFalse(self.t.hassubset(q))
+    self.assertEqual(list(self.t.supersets(q)), [{1, 3, 5}, {2, 3, 5}])
+    self.assertEqual(list(self.t.subsets(q)), [])
+    self.assertEqual(self.t.batch_hassuperset([q]), [True])
+    self.t.add(q)
+    self.assertTrue(q in self.t)
+    self.assertEqual(list(self.t.subsets(q)), [{3, 5}])
+    p = PreparedQuery((1, 3), presorted=True)
+    self.assertTrue(p in self.t)
+    self.assertEqual(list(self.t.supersets(p)), [{1, 3}, {1, 3, 5}])
+
+  def test_batch_hassuperset(self):
+    self.assertEqual(self.t.batch_hassuperset([{3, 5}, {6}, {1, 2, 4}, {2, 4, 5}]),
+                     [True, False, True, False])
+    # with the bitmasks built, hassuperset() scans them
+    self.assertTrue(self.t.hassuperset({3, 5}))
+    self.assertFalse(self.t.hassuperset({2, 4, 5}))
+    self.assertFalse(self.t.hassuperset({6}))
+    # the query is read once, and repeated elements are answered like
+    # by the trie search
+    self.assertFalse(self.t.hassuperset(x for x in [2, 4, 5]))
+    self.assertTrue(self.t.hassuperset(x for x in [2, 4]))
+    self.assertFalse(self.t.hassuperset([1, 1]))
+    self.t.add({2, 4, 5})
+    self.assertEqual(self.t.batch_hassuperset([{2, 4, 5}]), [True])
+
+  def test_batch_hassubset(self):
+    self.assertEqual(self.t.batch_hassubset([{1, 2, 3}, {2, 3, 4, 5}, {3, 4, 5},
+                                             {6, 7, 8, 9, 1000}]),
+                     [True, True, False, False])
+
+  def test_freeze_bitset(self):
+    self.assertEqual(self.t.freeze_bitset(6),
+                     [0b10110, 0b1010, 0b101010, 0b10010, 0b101100, 0b10100])
+    self.assertEqual(self.t.bitset_supersets(0b101000), [0b101010, 0b101100])
+    self.assertEqual(self.t.bitset_subsets(0b111010), [0b1010, 0b101010, 0b10010])
+    self.assertTrue(self.t.hassubset_bitset(0b10100))
+    self.assertFalse(self.t.hassubset_bitset(0b100110))
+    self.assertRaises(ValueError, self.t.freeze_bitset, 5)
+    self.assertRaises(ValueError, SetTrie([{'a'}]).freeze_bitset)
+
+  def test_from_bitsets(self):
+    t = SetTrie.from_bitsets([0b10110, 0b1010, 0b101010, 0b10010, 0b101100,
+                              0b10100, 0b1010])
+    self.assertEqual(list(t), list(self.t))
+    self.assertTrue(t.hassuperset_bitset(0b101000))
+    self.assertFalse(t.hassuperset_bitset(0b110100))
+    self.assertEqual(list(SetTrie.from_bitsets([0])), [set()])
+    self.assertRaises(ValueError, SetTrie.from_bitsets, [-1])
+
   def test_subsets(self):
     self.assertEqual(list(self.t.subsets({1, 2, 4, 11})), [{1, 2, 4}, {1, 4}, {2, 4}])
+    self.assertEqual(list(self.t.subsets({1, 2, 4, 11}, as_tuples=True)), [(1, 2, 4), (1, 4), (2, 4)])
     self.assertEqual(list(self.t.subsets({1, 2, 4})), [{1, 2, 4}, {1, 4}, {2, 4}])
     self.assertEqual(list(self.t.subsets({1, 2})), [])
     self.assertEqual(list(self.t.subsets({1, 2, 3, 4, 5})), [{1, 2, 4}, {1, 3}, {1, 3, 5}, {1, 4}, {2, 3, 5}, {2, 4}])
@@ -109,6 +295,14 @@ class TestSetTrie(unittest.TestCase):
     self.assertEqual(list(self.t.subsets({1, 4, 8})), [{1, 4}])
     self.assertEqual(list(self.t.subsets({2, 3, 4, 5})), [{2, 3, 5}, {2, 4}])
     self.assertEqual(list(self.t.subsets({2, 3, 5, 6})), [{2, 3, 5}])
+    # queries with repeated elements give each subset once
+    self.assertEqual(list(self.t.subsets([2, 4, 4, 1, 2])), [{1, 2, 4}, {1, 4}, {2, 4}])
+    self.assertEqual(list(SetTrie([{1}, {2}, {3}]).subsets([1, 1])), [{1}])
+    import itertools
+    wide = SetTrie(map(set, itertools.combinations(range(20), 3)))
+    self.assertEqual(list(wide.subsets([0, 0, 1, 1, 2, 2])), [{0, 1, 2}])
+    t = SetTrie([{'a'}, {'a', 'b'}, {'c'}], intern_elements=True)
+    self.assertEqual(sorted(map(sorted, t.subsets(['a', 'b', 'a', 'b']))), [['a'], ['a', 'b']])
 
 
 class TestSetTrieMap(unittest.TestCase):
@@ -169,6 +363,7 @@ class TestSetTrieMap(unittest.TestCase):
     self.assertEqual(self.t.get({100, 200}), None)
     self.t[{100, 200}] = 'FOO'
     self.assertEqual(self.t.get({100, 200}), 'FOO')
+    self.assertEqual(len(self.t), 7)
     self.setUp()
 
   def test_hassuperset(self):
@@ -179,9 +374,12 @@ class TestSetTrieMap(unittest.TestCase):
   
   def test_supersets(self):
     self.assertEqual(list(self.t.supersets({3, 5})), [({1, 3, 5}, 'B'), ({2, 3, 5}, 'F')])
+    self.assertEqual(list(self.t.supersets({3, 5}, as_tuples=True)), [((1, 3, 5), 'B'), ((2, 3, 5), 'F')])
     self.assertEqual(list(self.t.supersets({1})), [({1, 2, 4}, 'D'), ({1, 3}, 'A'), ({1, 3, 5}, 'B'), ({1, 4}, 'C')])
     self.assertEqual(list(self.t.supersets({1, 2, 5})), [])
     self.assertEqual(list(self.t.supersets({3, 5}, mode='keys')), [{1, 3, 5}, {2, 3, 5}])
+    self.assertEqual(list(self.t.supersets({3, 5}, mode='keys', as_tuples=True)), [(1, 3, 5), (2, 3, 5)])
+    self.assertEqual(set(self.t.supersets({3, 5}, mode='keys', as_frozensets=True)), {frozenset({1, 3, 5}), frozenset({2, 3, 5})})
     self.assertEqual(list(self.t.supersets({1}, mode='keys')), [{1, 2, 4}, {1, 3}, {1, 3, 5}, {1, 4}])
     self.assertEqual(list(self.t.supersets({1, 2, 5}, mode='keys')), [])
     self.assertEqual(list(self.t.supersets({3, 5}, mode='values')), ['B', 'F'])
@@ -213,6 +411,8 @@ class TestSetTrieMap(unittest.TestCase):
     self.assertEqual(list(self.t.subsets({1, 2}, mode='keys')), [])
     self.assertEqual(list(self.t.subsets({1, 2, 3, 4, 5}, mode='keys')), [{1, 2, 4}, {1, 3}, {1, 3, 5}, {1, 4}, {2, 3, 5}, {2, 4}])
     self.assertEqual(list(self.t.subsets({0, 1, 3, 5}, mode='keys')), [{1, 3}, {1, 3, 5}])
+    self.assertEqual(list(self.t.subsets((1, 3, 3, 5, 1))), [({1, 3}, 'A'), ({1, 3, 5}, 'B')])
+    self.assertEqual(list(self.t.subsets([4, 1, 4], mode='values')), ['C'])
     self.assertEqual(list(self.t.subsets({1, 2, 5}, mode='keys')), [])
     self.assertEqual(list(self.t.subsets({1, 2, 4, 11}, mode='values')), ['D', 'C', 'E'])
     self.assertEqual(list(self.t.subsets({1, 2, 4}, mode='values')), ['D', 'C', 'E'])
@@ -229,12 +429,19 @@ class TestSetTrieMap(unittest.TestCase):
     
     
 
+  def test_pickle(self):
+    import pickle
+    t2 = pickle.loads(pickle.dumps(self.t))
+    self.assertEqual(list(t2.items()), list(self.t.items()))
+
   def test_iters(self):
     self.assertEqual(list(self.t), 
       [{1, 2, 4}, {1, 3}, {1, 3, 5}, {1, 4}, {2, 3, 5}, {2, 4}] )
     self.assertEqual(list(self.t.keys()), [{1, 2, 4}, {1, 3}, {1, 3, 5}, {1, 4}, {2, 3, 5}, {2, 4}] )
     self.assertEqual(list(self.t.values()), ['D', 'A', 'B', 'C', 'F', 'E'] )
     self.assertEqual(list(self.t.__iter__()), list(self.t.keys()))
+    self.t[{1, 3}] = 'AA'
+    self.assertEqual(list(self.t.values()), ['D', 'AA', 'B', 'C', 'F', 'E'] )
 
 
 class TestSetTrieMultiMap(unittest.TestCase):
@@ -251,6 +458,22 @@ class TestSetTrieMultiMap(unittest.TestCase):
     self.assertEqual(list(self.t), 
       [{1, 2, 4}, {1, 3}, {1, 3, 5},
        {1, 4}, {2, 3, 5}, {2, 4}] )
+    self.assertEqual(len(self.t), 6)
+
+  def test_bulk_add(self):
+    t = SetTrieMultiMap()
+    t[{1, 3}] = 'A'
+    t.bulk_add([({1, 3}, 'AA'), ({2, 4}, 'E'), ({3, 1}, 'AAA')])
+    self.assertEqual(list(t.items()), [({1, 3}, 'A'), ({1, 3}, 'AA'), ({1, 3}, 'AAA'),
+                                       ({2, 4}, 'E')])
+    self.assertEqual(len(t), 2)
+
+  def test_init_bulk(self):
+    t = SetTrieMultiMap([({2, 4}, 'E'), ({1, 3}, 'A'),
+                         ({2, 4}, 'EE'), ({1}, 'B')])
+    self.assertEqual(list(t.items()),
+                     [({1}, 'B'), ({1, 3}, 'A'), ({2, 4}, 'E'), ({2, 4}, 'EE')])
+    self.assertEqual(t[{2, 4}], ['E', 'EE'])
 
   def test_get(self):
     self.assertEqual(self.t.get({1, 3}), ['A', 'AA'])